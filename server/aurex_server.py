@@ -10,32 +10,38 @@ import logging
 import os
 import subprocess
 import sys
+import tempfile
 import websockets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional
 import psutil
-import pyautogui
-import keyboard
-import mouse
 from pathlib import Path
+# pyautogui and keyboard are imported inside their handlers so this module loads headless
+from file_transfer import FileTransferManager, TransferSession
+from protocol import CommandResult, available_codecs, codec_for
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('aurex_server.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+def configure_logging():
+    """Log to the console and aurex_server.log; called by main() so importing stays side-effect free"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('aurex_server.log'),
+            logging.StreamHandler()
+        ]
+    )
+
 class CommandExecutor:
     """Handles execution of various commands on the laptop"""
     
     def __init__(self):
+        # Stored already serialized so each save is a plain json.dump
         self.command_history: List[Dict] = []
         self.custom_commands = self.load_custom_commands()
+        self.history_path = Path(__file__).parent / "data" / "command_history.json"
         
     def load_custom_commands(self) -> Dict[str, str]:
         """Load custom command mappings from config file"""
@@ -50,29 +56,25 @@ class CommandExecutor:
     
     def save_command_history(self):
         """Save command history to file"""
-        history_path = Path(__file__).parent / "data" / "command_history.json"
-        history_path.parent.mkdir(exist_ok=True)
+        self.history_path.parent.mkdir(exist_ok=True)
         
+        # Write a temp file and swap it in so readers (file transfers) keep the old contents
+        temp_path = self.history_path.with_name(self.history_path.name + ".tmp")
         try:
-            with open(history_path, 'w') as f:
-                json.dump(self.command_history, f, indent=2, default=str)
+            with open(temp_path, 'w') as f:
+                json.dump(self.command_history, f, indent=2)
+            os.replace(temp_path, self.history_path)
         except Exception as e:
             logger.error(f"Failed to save command history: {e}")
     
-    def execute_command(self, command_text: str) -> Dict:
+    def execute_command(self, command_text: str) -> CommandResult:
         """Execute a command and return the result"""
         command_text = command_text.strip().lower()
         timestamp = datetime.now()
         
         logger.info(f"Executing command: {command_text}")
         
-        result = {
-            "command": command_text,
-            "timestamp": timestamp.isoformat(),
-            "success": False,
-            "output": "",
-            "error": ""
-        }
+        result = CommandResult(command_text, timestamp=timestamp)
         
         try:
             # Check for custom commands first
@@ -82,20 +84,23 @@ class CommandExecutor:
                 # Handle built-in commands
                 result = self.execute_builtin_command(command_text)
             
+            # Stamp the arrival time, not completion, so the history keeps real inter-arrival gaps
+            result.timestamp = timestamp
+            
             # Add to history
-            self.command_history.append(result)
+            self.command_history.append(result.to_dict())
             if len(self.command_history) > 1000:  # Keep last 1000 commands
                 self.command_history = self.command_history[-1000:]
             
             self.save_command_history()
             
         except Exception as e:
-            result["error"] = str(e)
+            result.error = str(e)
             logger.error(f"Command execution failed: {e}")
         
         return result
     
-    def execute_custom_command(self, command_text: str) -> Dict:
+    def execute_custom_command(self, command_text: str) -> CommandResult:
         """Execute a custom command"""
         custom_cmd = self.custom_commands[command_text]
         logger.info(f"Executing custom command: {custom_cmd}")
@@ -110,23 +115,16 @@ class CommandExecutor:
                 timeout=30
             )
             
-            return {
-                "command": command_text,
-                "timestamp": datetime.now().isoformat(),
-                "success": process.returncode == 0,
-                "output": process.stdout,
-                "error": process.stderr
-            }
+            return CommandResult(
+                command_text,
+                success=process.returncode == 0,
+                output=process.stdout,
+                error=process.stderr
+            )
         except subprocess.TimeoutExpired:
-            return {
-                "command": command_text,
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": "Command timed out"
-            }
+            return CommandResult(command_text, error="Command timed out")
     
-    def execute_builtin_command(self, command_text: str) -> Dict:
+    def execute_builtin_command(self, command_text: str) -> CommandResult:
         """Execute built-in commands"""
         
         # System commands
@@ -189,7 +187,7 @@ class CommandExecutor:
         else:
             return self.run_shell_command(command_text)
     
-    def lock_computer(self) -> Dict:
+    def lock_computer(self) -> CommandResult:
         """Lock the computer"""
         try:
             if sys.platform == "win32":
@@ -199,23 +197,11 @@ class CommandExecutor:
             else:  # Linux
                 subprocess.run(["gnome-screensaver-command", "--lock"])
             
-            return {
-                "command": "lock computer",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Computer locked successfully",
-                "error": ""
-            }
+            return CommandResult("lock computer", success=True, output="Computer locked successfully")
         except Exception as e:
-            return {
-                "command": "lock computer",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("lock computer", error=str(e))
     
-    def sleep_computer(self) -> Dict:
+    def sleep_computer(self) -> CommandResult:
         """Put computer to sleep"""
         try:
             if sys.platform == "win32":
@@ -226,23 +212,11 @@ class CommandExecutor:
             else:
                 subprocess.run(["systemctl", "suspend"])
             
-            return {
-                "command": "sleep",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Computer put to sleep",
-                "error": ""
-            }
+            return CommandResult("sleep", success=True, output="Computer put to sleep")
         except Exception as e:
-            return {
-                "command": "sleep",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("sleep", error=str(e))
     
-    def shutdown_computer(self) -> Dict:
+    def shutdown_computer(self) -> CommandResult:
         """Shutdown the computer"""
         try:
             if sys.platform == "win32":
@@ -252,23 +226,11 @@ class CommandExecutor:
             else:
                 subprocess.run(["sudo", "shutdown", "-h", "now"])
             
-            return {
-                "command": "shutdown",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Computer shutting down",
-                "error": ""
-            }
+            return CommandResult("shutdown", success=True, output="Computer shutting down")
         except Exception as e:
-            return {
-                "command": "shutdown",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("shutdown", error=str(e))
     
-    def restart_computer(self) -> Dict:
+    def restart_computer(self) -> CommandResult:
         """Restart the computer"""
         try:
             if sys.platform == "win32":
@@ -278,23 +240,11 @@ class CommandExecutor:
             else:
                 subprocess.run(["sudo", "shutdown", "-r", "now"])
             
-            return {
-                "command": "restart",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Computer restarting",
-                "error": ""
-            }
+            return CommandResult("restart", success=True, output="Computer restarting")
         except Exception as e:
-            return {
-                "command": "restart",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("restart", error=str(e))
     
-    def open_application(self, app_name: str) -> Dict:
+    def open_application(self, app_name: str) -> CommandResult:
         """Open an application"""
         try:
             # Common applications mapping
@@ -319,23 +269,11 @@ class CommandExecutor:
             else:
                 subprocess.Popen([app_to_open])
             
-            return {
-                "command": f"open {app_name}",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": f"Opened {app_name}",
-                "error": ""
-            }
+            return CommandResult(f"open {app_name}", success=True, output=f"Opened {app_name}")
         except Exception as e:
-            return {
-                "command": f"open {app_name}",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult(f"open {app_name}", error=str(e))
     
-    def close_application(self, app_name: str) -> Dict:
+    def close_application(self, app_name: str) -> CommandResult:
         """Close an application"""
         try:
             # Kill processes by name
@@ -343,145 +281,68 @@ class CommandExecutor:
                 if app_name.lower() in proc.info['name'].lower():
                     proc.kill()
             
-            return {
-                "command": f"close {app_name}",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": f"Closed {app_name}",
-                "error": ""
-            }
+            return CommandResult(f"close {app_name}", success=True, output=f"Closed {app_name}")
         except Exception as e:
-            return {
-                "command": f"close {app_name}",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult(f"close {app_name}", error=str(e))
     
-    def media_play_pause(self) -> Dict:
+    def media_play_pause(self) -> CommandResult:
         """Media play/pause"""
         try:
+            import keyboard
             keyboard.press_and_release('play/pause media')
-            return {
-                "command": "play/pause",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Media play/pause toggled",
-                "error": ""
-            }
+            return CommandResult("play/pause", success=True, output="Media play/pause toggled")
         except Exception as e:
-            return {
-                "command": "play/pause",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("play/pause", error=str(e))
     
-    def media_next(self) -> Dict:
+    def media_next(self) -> CommandResult:
         """Next track"""
         try:
+            import keyboard
             keyboard.press_and_release('next track media')
-            return {
-                "command": "next track",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Next track",
-                "error": ""
-            }
+            return CommandResult("next track", success=True, output="Next track")
         except Exception as e:
-            return {
-                "command": "next track",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("next track", error=str(e))
     
-    def media_previous(self) -> Dict:
+    def media_previous(self) -> CommandResult:
         """Previous track"""
         try:
+            import keyboard
             keyboard.press_and_release('previous track media')
-            return {
-                "command": "previous track",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Previous track",
-                "error": ""
-            }
+            return CommandResult("previous track", success=True, output="Previous track")
         except Exception as e:
-            return {
-                "command": "previous track",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("previous track", error=str(e))
     
-    def volume_up(self) -> Dict:
+    def volume_up(self) -> CommandResult:
         """Increase volume"""
         try:
+            import keyboard
             keyboard.press_and_release('volume up')
-            return {
-                "command": "volume up",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Volume increased",
-                "error": ""
-            }
+            return CommandResult("volume up", success=True, output="Volume increased")
         except Exception as e:
-            return {
-                "command": "volume up",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("volume up", error=str(e))
     
-    def volume_down(self) -> Dict:
+    def volume_down(self) -> CommandResult:
         """Decrease volume"""
         try:
+            import keyboard
             keyboard.press_and_release('volume down')
-            return {
-                "command": "volume down",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Volume decreased",
-                "error": ""
-            }
+            return CommandResult("volume down", success=True, output="Volume decreased")
         except Exception as e:
-            return {
-                "command": "volume down",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("volume down", error=str(e))
     
-    def volume_mute(self) -> Dict:
+    def volume_mute(self) -> CommandResult:
         """Mute/unmute volume"""
         try:
+            import keyboard
             keyboard.press_and_release('volume mute')
-            return {
-                "command": "mute",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Volume muted/unmuted",
-                "error": ""
-            }
+            return CommandResult("mute", success=True, output="Volume muted/unmuted")
         except Exception as e:
-            return {
-                "command": "mute",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("mute", error=str(e))
     
-    def take_screenshot(self) -> Dict:
+    def take_screenshot(self) -> CommandResult:
         """Take a screenshot"""
         try:
+            import pyautogui
             screenshot_path = Path(__file__).parent / "screenshots"
             screenshot_path.mkdir(exist_ok=True)
             
@@ -492,63 +353,29 @@ class CommandExecutor:
             screenshot = pyautogui.screenshot()
             screenshot.save(filepath)
             
-            return {
-                "command": "screenshot",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": f"Screenshot saved: {filepath}",
-                "error": ""
-            }
+            return CommandResult("screenshot", success=True, output=f"Screenshot saved: {filepath}")
         except Exception as e:
-            return {
-                "command": "screenshot",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("screenshot", error=str(e))
     
-    def copy_to_clipboard(self) -> Dict:
+    def copy_to_clipboard(self) -> CommandResult:
         """Copy selected text to clipboard"""
         try:
+            import pyautogui
             pyautogui.hotkey('ctrl', 'c')
-            return {
-                "command": "copy",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Copied to clipboard",
-                "error": ""
-            }
+            return CommandResult("copy", success=True, output="Copied to clipboard")
         except Exception as e:
-            return {
-                "command": "copy",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("copy", error=str(e))
     
-    def paste_from_clipboard(self) -> Dict:
+    def paste_from_clipboard(self) -> CommandResult:
         """Paste from clipboard"""
         try:
+            import pyautogui
             pyautogui.hotkey('ctrl', 'v')
-            return {
-                "command": "paste",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": "Pasted from clipboard",
-                "error": ""
-            }
+            return CommandResult("paste", success=True, output="Pasted from clipboard")
         except Exception as e:
-            return {
-                "command": "paste",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("paste", error=str(e))
     
-    def get_system_info(self) -> Dict:
+    def get_system_info(self) -> CommandResult:
         """Get system information"""
         try:
             cpu_percent = psutil.cpu_percent(interval=1)
@@ -563,23 +390,11 @@ class CommandExecutor:
                 "uptime": str(datetime.now() - datetime.fromtimestamp(psutil.boot_time()))
             }
             
-            return {
-                "command": "system info",
-                "timestamp": datetime.now().isoformat(),
-                "success": True,
-                "output": json.dumps(info, indent=2),
-                "error": ""
-            }
+            return CommandResult("system info", success=True, output=json.dumps(info, indent=2))
         except Exception as e:
-            return {
-                "command": "system info",
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult("system info", error=str(e))
     
-    def run_shell_command(self, command: str) -> Dict:
+    def run_shell_command(self, command: str) -> CommandResult:
         """Run a shell command"""
         try:
             process = subprocess.run(
@@ -590,37 +405,70 @@ class CommandExecutor:
                 timeout=30
             )
             
-            return {
-                "command": command,
-                "timestamp": datetime.now().isoformat(),
-                "success": process.returncode == 0,
-                "output": process.stdout,
-                "error": process.stderr
-            }
+            return CommandResult(
+                command,
+                success=process.returncode == 0,
+                output=process.stdout,
+                error=process.stderr
+            )
         except subprocess.TimeoutExpired:
-            return {
-                "command": command,
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": "Command timed out"
-            }
+            return CommandResult(command, error="Command timed out")
         except Exception as e:
-            return {
-                "command": command,
-                "timestamp": datetime.now().isoformat(),
-                "success": False,
-                "output": "",
-                "error": str(e)
-            }
+            return CommandResult(command, error=str(e))
+
+class DryRunExecutor(CommandExecutor):
+    """Routes commands like CommandExecutor but skips their side effects
+    
+    Used by replay_history.py and by the server when AUREX_DRY_RUN=1 is set.
+    The command history is written to a temp file so the real one is untouched.
+    """
+    
+    # Handler name -> the command label the real handler reports
+    SIDE_EFFECT_HANDLERS = {
+        "execute_custom_command": "{}",
+        "run_shell_command": "{}",
+        "lock_computer": "lock computer",
+        "sleep_computer": "sleep",
+        "shutdown_computer": "shutdown",
+        "restart_computer": "restart",
+        "open_application": "open {}",
+        "close_application": "close {}",
+        "media_play_pause": "play/pause",
+        "media_next": "next track",
+        "media_previous": "previous track",
+        "volume_up": "volume up",
+        "volume_down": "volume down",
+        "volume_mute": "mute",
+        "take_screenshot": "screenshot",
+        "copy_to_clipboard": "copy",
+        "paste_from_clipboard": "paste"
+    }
+    
+    def __init__(self):
+        super().__init__()
+        self.history_path = Path(tempfile.gettempdir()) / "aurex_dry_run" / "command_history.json"
+        for name, label in self.SIDE_EFFECT_HANDLERS.items():
+            setattr(self, name, self.make_stub(label))
+    
+    @staticmethod
+    def make_stub(label: str):
+        """Build a handler that reports success without doing anything"""
+        def stub(*args) -> CommandResult:
+            command = label.format(*args)
+            return CommandResult(command, success=True, output=f"[dry run] {command}")
+        return stub
 
 class AurexServer:
     """WebSocket server for handling iPhone app connections"""
     
-    def __init__(self, host: str = "0.0.0.0", port: int = 8765):
+    def __init__(self, host: str = "0.0.0.0", port: int = 8765,
+                 executor: Optional[CommandExecutor] = None):
         self.host = host
         self.port = port
-        self.executor = CommandExecutor()
+        self.executor = executor or CommandExecutor()
+        self.file_transfers = FileTransferManager()
+        # Commands run one at a time off the event loop so file transfers keep streaming
+        self.command_pool = ThreadPoolExecutor(max_workers=1)
         self.clients = set()
     
     async def handle_client(self, websocket, path):
@@ -628,52 +476,103 @@ class AurexServer:
         client_id = id(websocket)
         self.clients.add(websocket)
         
-        logger.info(f"Client {client_id} connected from {websocket.remote_address}")
+        # Negotiated through the WebSocket subprotocol, JSON when none was offered
+        codec = codec_for(websocket.subprotocol)
+        transfers = TransferSession(self.file_transfers, websocket, codec)
+        
+        logger.info(f"Client {client_id} connected from {websocket.remote_address} ({codec.name})")
         
         try:
             async for message in websocket:
                 try:
+                    # Binary frames carry requests in the connection's encoding
+                    if isinstance(message, bytes):
+                        request = codec.decode(message)
+                        if not isinstance(request, dict):
+                            raise ValueError("Expected a map")
+                        if "command" not in request:
+                            await transfers.handle_request(request)
+                            continue
+                        message = str(request["command"])
+                    
                     # Parse the command
                     command_text = message.strip()
                     
                     if not command_text:
                         continue
                     
-                    # Execute the command
-                    result = self.executor.execute_command(command_text)
+                    # JSON file_* requests are file transfer controls; anything else,
+                    # including shell brace groups like "{ ls; }", is a command
+                    request = self.parse_control_request(command_text)
+                    if request is not None:
+                        await transfers.handle_request(request)
+                        continue
+                    
+                    # Execute and encode the command off the event loop
+                    loop = asyncio.get_running_loop()
+                    result, response = await loop.run_in_executor(
+                        self.command_pool, self.execute_and_encode, codec, command_text
+                    )
                     
                     # Send result back to client
-                    response = json.dumps(result)
                     await websocket.send(response)
                     
-                    logger.info(f"Command executed: {command_text} - Success: {result['success']}")
+                    logger.info(f"Command executed: {command_text} - Success: {result.success}")
                     
                 except json.JSONDecodeError:
                     logger.error(f"Invalid JSON from client {client_id}")
-                    await websocket.send(json.dumps({
+                    await transfers.send_message({
                         "error": "Invalid JSON format",
                         "success": False
-                    }))
+                    })
                 except Exception as e:
                     logger.error(f"Error processing command from client {client_id}: {e}")
-                    await websocket.send(json.dumps({
+                    await transfers.send_message({
                         "error": str(e),
                         "success": False
-                    }))
+                    })
         
         except websockets.exceptions.ConnectionClosed:
             logger.info(f"Client {client_id} disconnected")
         except Exception as e:
             logger.error(f"Error with client {client_id}: {e}")
         finally:
+            await transfers.close()
             self.clients.remove(websocket)
     
+    @staticmethod
+    def parse_control_request(command_text: str) -> Optional[Dict]:
+        """Return the request if a text message is a file transfer control"""
+        if not command_text.startswith("{"):
+            return None
+        try:
+            request = json.loads(command_text)
+        except json.JSONDecodeError:
+            return None
+        if isinstance(request, dict) and str(request.get("type", "")).startswith("file_"):
+            return request
+        return None
+    
+    def execute_and_encode(self, codec, command_text: str):
+        """Run a command and serialize its result in the client's encoding"""
+        result = self.executor.execute_command(command_text)
+        return result, codec.encode(result.to_dict())
+    
+    def serve(self):
+        """Create the WebSocket server, used as an async context manager"""
+        return websockets.serve(
+            self.handle_client,
+            self.host,
+            self.port,
+            subprotocols=[codec.name for codec in available_codecs()]
+        )
+    
     async def start_server(self):
         """Start the WebSocket server"""
         logger.info(f"Starting Aurex server on {self.host}:{self.port}")
         
         try:
-            async with websockets.serve(self.handle_client, self.host, self.port):
+            async with self.serve():
                 logger.info("Aurex server is running. Press Ctrl+C to stop.")
                 await asyncio.Future()  # Run forever
         except KeyboardInterrupt:
@@ -683,6 +582,8 @@ class AurexServer:
 
 def main():
     """Main entry point"""
+    configure_logging()
+    
     print("=" * 50)
     print("Aurex Server - iPhone Command Interface")
     print("=" * 50)
@@ -690,9 +591,12 @@ def main():
     # Get server configuration
     host = os.getenv("AUREX_HOST", "0.0.0.0")
     port = int(os.getenv("AUREX_PORT", "8765"))
+    dry_run = os.getenv("AUREX_DRY_RUN", "0") == "1"
     
     # Create and start server
-    server = AurexServer(host, port)
+    if dry_run:
+        logger.info("Dry run: commands are routed but not executed")
+    server = AurexServer(host, port, DryRunExecutor() if dry_run else None)
     
     try:
         asyncio.run(server.start_server())
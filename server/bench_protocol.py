@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Aurex protocol benchmark - encode cost and bytes on the wire per codec
+Run with: python3 bench_protocol.py [iterations]
+"""
+
+import json
+import sys
+import timeit
+
+from protocol import CommandResult, JSONCodec, MessagePackCodec, msgpack
+
+
+def sample_results():
+    """Representative results: a media key, system info and a shell listing"""
+    return {
+        "short": CommandResult("volume up", success=True, output="Volume increased"),
+        "system info": CommandResult("system info", success=True, output=json.dumps({
+            "cpu_usage": "12.5%",
+            "memory_usage": "48.1%",
+            "disk_usage": "63.0%",
+            "platform": "linux",
+            "uptime": "3 days, 4:12:09.123456"
+        }, indent=2)),
+        "shell output": CommandResult(
+            "ps aux",
+            success=True,
+            output="\n".join(f"user {pid} 0.0 0.1 123456 7890 ? S 10:00 0:00 /usr/bin/process-{pid}"
+                             for pid in range(1000, 1200))
+        )
+    }
+
+
+def baseline_encode(result: CommandResult) -> str:
+    """The previous path: a dict literal per handler, json.dumps in the handler loop"""
+    return json.dumps({
+        "command": result.command,
+        "timestamp": result.timestamp.isoformat(),
+        "success": result.success,
+        "output": result.output,
+        "error": result.error
+    })
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    encoders = [("json (baseline)", baseline_encode)]
+    codecs = [JSONCodec()]
+    if msgpack is not None:
+        codecs.append(MessagePackCodec())
+    else:
+        print("msgpack is not installed; only JSON is measured")
+    for codec in codecs:
+        encoders.append((codec.name, lambda result, codec=codec: codec.encode(result.to_dict())))
+
+    print(f"{'payload':<14} {'encoding':<16} {'bytes':>8} {'us/msg':>8}")
+    for label, result in sample_results().items():
+        for name, encode in encoders:
+            encoded = encode(result)
+            size = len(encoded.encode('utf-8') if isinstance(encoded, str) else encoded)
+            seconds = timeit.timeit(lambda: encode(result), number=iterations)
+            print(f"{label:<14} {name:<16} {size:>8} {seconds / iterations * 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
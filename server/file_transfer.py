@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Aurex file transfer - streams host files to the iPhone app
+Files are sent as binary WebSocket frames with byte-range resume and checksums
+
+Protocol requests from the client:
+    {"type": "file_list"}
+    {"type": "file_get", "path": "screenshots/x.png", "offset": 0, "sha256": "..."}
+    {"type": "file_cancel", "transfer_id": 1}
+
+The server answers a file_get with a "file_start" message, a series of chunks,
+then a "file_end" message. Each chunk carries its transfer_id, byte offset and
+crc32 alongside the data. How messages are framed depends on the encoding the
+connection negotiated (see protocol.py):
+
+    aurex.json (default): requests and replies are JSON text messages. Chunks
+    are binary frames with a 16 byte header (transfer_id u32, offset u64,
+    crc32 u32, network byte order) followed by the data.
+
+    aurex.msgpack: replies are binary MessagePack maps, and so are chunks, as
+    {"type": "file_chunk", "transfer_id", "offset", "crc32", "data"}. Requests
+    may be MessagePack maps or JSON text messages.
+
+To resume after a disconnect, the client sends file_get again with the number
+of bytes it already has as "offset" and the sha256 from the original
+file_start; if the file changed in the meantime the server restarts the
+transfer from byte 0.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import zlib
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from protocol import CHUNK_HEADER
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+HASH_BLOCK_SIZE = 1024 * 1024
+CHECKSUM_CACHE_SIZE = 64
+
+# Directories the client is allowed to download from, relative to the server
+TRANSFER_ROOTS = ["screenshots", "data", "logs"]
+
+
+class FileTransferError(Exception):
+    """Raised when a transfer request cannot be served"""
+
+
+class FileTransferManager:
+    """Resolves transfer requests and caches file checksums"""
+
+    def __init__(self, base_dir: Optional[Path] = None, roots: Optional[List[str]] = None):
+        self.base_dir = (base_dir or Path(__file__).parent).resolve()
+        self.roots = [self.base_dir / root for root in (roots or TRANSFER_ROOTS)]
+        # path -> (size, mtime_ns, sha256), least recently used first
+        self._checksums: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+
+    def resolve_path(self, relative_path: str) -> Path:
+        """Resolve a client path and make sure it stays inside a transfer root"""
+        path = (self.base_dir / relative_path).resolve()
+        for root in self.roots:
+            try:
+                path.relative_to(root.resolve())
+            except ValueError:
+                continue
+            if not path.is_file():
+                raise FileTransferError(f"File not found: {relative_path}")
+            return path
+        raise FileTransferError(f"Access denied: {relative_path}")
+
+    def list_files(self) -> List[Dict]:
+        """List downloadable files with their sizes"""
+        files = []
+        for root in self.roots:
+            if not root.is_dir():
+                continue
+            for path in sorted(root.rglob("*")):
+                if path.is_file():
+                    stat = path.stat()
+                    files.append({
+                        "path": path.relative_to(self.base_dir).as_posix(),
+                        "size": stat.st_size,
+                        "modified": stat.st_mtime
+                    })
+        return files
+
+    async def checksum(self, path: Path, file) -> Tuple[str, int]:
+        """Return the sha256 and size of an open file, hashing off the event loop
+
+        Hashing the handle that will be streamed guarantees the digest and the
+        bytes sent come from the same file, even if the path is replaced.
+        """
+        stat = os.fstat(file.fileno())
+        key = str(path)
+        cached = self._checksums.get(key)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            self._checksums.move_to_end(key)
+            return cached[2], stat.st_size
+
+        digest = await asyncio.get_running_loop().run_in_executor(None, self._hash_file, file)
+        # Only the latest version of each file is kept, and only for recent files
+        self._checksums[key] = (stat.st_size, stat.st_mtime_ns, digest)
+        self._checksums.move_to_end(key)
+        while len(self._checksums) > CHECKSUM_CACHE_SIZE:
+            self._checksums.popitem(last=False)
+        return digest, stat.st_size
+
+    @staticmethod
+    def _hash_file(file) -> str:
+        sha = hashlib.sha256()
+        buffer = bytearray(HASH_BLOCK_SIZE)
+        view = memoryview(buffer)
+        file.seek(0)
+        while True:
+            n = file.readinto(buffer)
+            if not n:
+                break
+            sha.update(view[:n])
+        return sha.hexdigest()
+
+
+class Transfer:
+    """State of a single file being streamed to a client"""
+
+    def __init__(self, transfer_id: int, path: Path, file, size: int, offset: int):
+        self.transfer_id = transfer_id
+        self.path = path
+        self.size = size
+        self.offset = offset
+        self.file = file
+        self.file.seek(offset)
+
+    def read_chunk(self) -> Optional[bytearray]:
+        """Read the next chunk straight into a framed buffer"""
+        length = min(CHUNK_SIZE, self.size - self.offset)
+        if length <= 0:
+            return None
+        frame = bytearray(CHUNK_HEADER.size + length)
+        view = memoryview(frame)[CHUNK_HEADER.size:]
+        try:
+            n = self.file.readinto(view)
+            crc32 = zlib.crc32(view[:n]) if n else 0
+        finally:
+            # The frame can only be trimmed once no view of it is left
+            view.release()
+        if not n:
+            return None
+        if n < length:
+            del frame[CHUNK_HEADER.size + n:]
+        CHUNK_HEADER.pack_into(frame, 0, self.transfer_id, self.offset, crc32)
+        self.offset += n
+        return frame
+
+    def close(self):
+        self.file.close()
+
+
+class TransferSession:
+    """Per-connection scheduler that streams active transfers round-robin
+
+    One chunk is sent per transfer per turn, so concurrent downloads share the
+    connection evenly and interactive command responses can slip in between
+    chunks instead of waiting for a whole file.
+    """
+
+    def __init__(self, manager: FileTransferManager, websocket, codec):
+        self.manager = manager
+        self.websocket = websocket
+        self.codec = codec
+        self.transfers: Dict[int, Transfer] = {}
+        self._queue: Deque[Transfer] = deque()
+        self._wakeup = asyncio.Event()
+        self._next_id = 1
+        self._task: Optional[asyncio.Task] = None
+        # file_get requests still hashing, so the connection can keep reading commands
+        self._starting: Set[asyncio.Task] = set()
+
+    async def send_message(self, payload: Dict):
+        await self.websocket.send(self.codec.encode(payload))
+
+    async def handle_request(self, request: Dict):
+        """Dispatch a file_* control message from the client"""
+        request_type = request.get("type")
+        try:
+            if request_type == "file_list":
+                await self.send_message({
+                    "type": "file_list",
+                    "success": True,
+                    "files": self.manager.list_files()
+                })
+            elif request_type == "file_get":
+                task = asyncio.ensure_future(self._start_in_background(request))
+                self._starting.add(task)
+                task.add_done_callback(self._starting.discard)
+            elif request_type == "file_cancel":
+                self.cancel(request.get("transfer_id"))
+            else:
+                raise FileTransferError(f"Unknown request type: {request_type}")
+        except (FileTransferError, OSError, ValueError) as e:
+            await self._request_failed(request, e)
+
+    async def _start_in_background(self, request: Dict):
+        try:
+            await self.start_transfer(request)
+        except (FileTransferError, OSError, ValueError) as e:
+            await self._request_failed(request, e)
+        except Exception as e:
+            logger.error(f"File transfer request failed: {e}")
+
+    async def _request_failed(self, request: Dict, error: Exception):
+        logger.error(f"File transfer request failed: {error}")
+        await self.send_message({
+            "type": "file_error",
+            "path": request.get("path"),
+            "transfer_id": request.get("transfer_id"),
+            "success": False,
+            "error": str(error)
+        })
+
+    async def start_transfer(self, request: Dict):
+        """Validate a file_get request and queue the transfer"""
+        relative_path = str(request.get("path", ""))
+        path = self.manager.resolve_path(relative_path)
+        file = open(path, 'rb', buffering=0)
+        try:
+            digest, size = await self.manager.checksum(path, file)
+
+            offset = int(request.get("offset", 0))
+            if offset < 0 or offset > size:
+                raise FileTransferError(f"Invalid offset {offset} for {relative_path}")
+            # A resume only makes sense against the same file contents
+            if offset and request.get("sha256") != digest:
+                offset = 0
+        except BaseException:
+            file.close()
+            raise
+
+        transfer_id = self._next_id
+        self._next_id += 1
+        transfer = Transfer(transfer_id, path, file, size, offset)
+        self.transfers[transfer_id] = transfer
+
+        await self.send_message({
+            "type": "file_start",
+            "transfer_id": transfer_id,
+            "path": relative_path,
+            "size": size,
+            "offset": offset,
+            "chunk_size": CHUNK_SIZE,
+            "sha256": digest,
+            "success": True
+        })
+        logger.info(f"Starting transfer {transfer_id}: {relative_path} from byte {offset} of {size}")
+
+        self._queue.append(transfer)
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    def cancel(self, transfer_id):
+        """Stop a transfer; the client may resume it later by offset"""
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer is None:
+            raise FileTransferError(f"Unknown transfer: {transfer_id}")
+        transfer.close()
+        logger.info(f"Cancelled transfer {transfer_id}")
+
+    async def _run(self):
+        """Send one chunk per active transfer per round until all are done"""
+        try:
+            while True:
+                if not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                transfer = self._queue.popleft()
+                if transfer.transfer_id not in self.transfers:
+                    continue  # Cancelled
+
+                # A file that fails to read only ends its own transfer
+                try:
+                    frame = transfer.read_chunk()
+                    message = None if frame is None else self.codec.encode_chunk(frame)
+                except Exception as e:
+                    await self._fail(transfer, f"Read failed: {e}")
+                    continue
+                if message is None:
+                    await self._finish(transfer)
+                    continue
+
+                await self.websocket.send(message)
+                self._queue.append(transfer)
+                # Let interactive command responses interleave with chunks
+                await asyncio.sleep(0)
+        except Exception as e:
+            logger.error(f"File transfer stopped: {e}")
+
+    async def _fail(self, transfer: Transfer, error: str):
+        """Drop a transfer and tell the client why"""
+        self.transfers.pop(transfer.transfer_id, None)
+        transfer.close()
+        logger.error(f"Transfer {transfer.transfer_id} failed: {error}")
+        await self.send_message({
+            "type": "file_error",
+            "transfer_id": transfer.transfer_id,
+            "success": False,
+            "error": error
+        })
+
+    async def _finish(self, transfer: Transfer):
+        if transfer.offset != transfer.size:
+            await self._fail(transfer, f"File changed during transfer ({transfer.offset} of {transfer.size} bytes sent)")
+            return
+        del self.transfers[transfer.transfer_id]
+        transfer.close()
+        await self.send_message({
+            "type": "file_end",
+            "transfer_id": transfer.transfer_id,
+            "size": transfer.size,
+            "success": True
+        })
+        logger.info(f"Completed transfer {transfer.transfer_id}: {transfer.path}")
+
+    async def close(self):
+        """Stop streaming and release open files when the client disconnects"""
+        for task in list(self._starting) + ([self._task] if self._task is not None else []):
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._task = None
+        for transfer in self.transfers.values():
+            transfer.close()
+        self.transfers.clear()
+        self._queue.clear()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Aurex wire protocol - command results and per-connection message encodings
+JSON is the default; MessagePack is used when the client asks for it through
+the "aurex.msgpack" WebSocket subprotocol and the msgpack package is installed
+"""
+
+import json
+import struct
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # Optional: only needed for the binary encoding
+    msgpack = None
+
+# File chunk frame header: transfer_id u32, offset u64, crc32 u32
+CHUNK_HEADER = struct.Struct("!IQI")
+
+
+class CommandResult:
+    """Result of a single command, shared by every CommandExecutor handler"""
+
+    __slots__ = ("command", "timestamp", "success", "output", "error")
+
+    def __init__(self, command: str, success: bool = False, output: str = "",
+                 error: str = "", timestamp: Optional[datetime] = None):
+        self.command = command
+        self.timestamp = timestamp or datetime.now()
+        self.success = success
+        self.output = output
+        self.error = error
+
+    def to_dict(self) -> Dict:
+        """The message shape sent to clients and stored in the command history"""
+        return {
+            "command": self.command,
+            "timestamp": self.timestamp.isoformat(),
+            "success": self.success,
+            "output": self.output,
+            "error": self.error
+        }
+
+
+class JSONCodec:
+    """Text frames holding JSON; file chunks go out as raw binary frames"""
+
+    name = "aurex.json"
+    binary = False
+
+    def encode(self, payload: Dict) -> str:
+        return json.dumps(payload)
+
+    def decode(self, message: Union[str, bytes]) -> Dict:
+        return json.loads(message)
+
+    def encode_chunk(self, frame: bytearray) -> bytearray:
+        return frame
+
+
+class MessagePackCodec:
+    """Binary frames holding MessagePack; file chunks are wrapped as messages"""
+
+    name = "aurex.msgpack"
+    binary = True
+
+    def encode(self, payload: Dict) -> bytes:
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, message: Union[str, bytes]) -> Dict:
+        if isinstance(message, str):
+            return json.loads(message)
+        return msgpack.unpackb(message, raw=False)
+
+    def encode_chunk(self, frame: bytearray) -> bytes:
+        transfer_id, offset, crc32 = CHUNK_HEADER.unpack_from(frame)
+        return msgpack.packb({
+            "type": "file_chunk",
+            "transfer_id": transfer_id,
+            "offset": offset,
+            "crc32": crc32,
+            "data": memoryview(frame)[CHUNK_HEADER.size:]
+        }, use_bin_type=True)
+
+
+def available_codecs() -> List:
+    """Codecs this server can offer, in order of preference"""
+    codecs = []
+    if msgpack is not None:
+        codecs.append(MessagePackCodec())
+    codecs.append(JSONCodec())
+    return codecs
+
+
+CODECS = {codec.name: codec for codec in available_codecs()}
+DEFAULT_CODEC = CODECS[JSONCodec.name]
+
+
+def codec_for(subprotocol: Optional[str]):
+    """Pick the codec for a negotiated subprotocol, falling back to JSON"""
+    return CODECS.get(subprotocol, DEFAULT_CODEC)
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Aurex history replay - turns recorded command streams into repeatable performance tests
+Replays data/command_history.json (or a synthetic history) against CommandExecutor
+or an AurexServer with side-effecting commands routed to dry-run stubs
+
+Examples:
+    python3 replay_history.py                          # recorded history, real timing, in-process
+    python3 replay_history.py --speed 10 --target server
+    python3 replay_history.py --synthetic 500 --rate 20 --speed 0 --save-baseline baseline.json
+    python3 replay_history.py --synthetic 500 --rate 20 --speed 0 --baseline baseline.json
+    python3 replay_history.py --url ws://127.0.0.1:8765  # a server started with AUREX_DRY_RUN=1
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from protocol import codec_for
+
+DEFAULT_HISTORY = Path(__file__).parent / "data" / "command_history.json"
+
+# "system info" is left out: its one second CPU sample would dominate every run
+SYNTHETIC_COMMANDS = [
+    "lock screen", "open chrome", "open spotify", "close chrome",
+    "play", "next", "previous", "volume up", "volume down", "mute",
+    "screenshot", "copy", "paste", "check disk space", "check time", "ls"
+]
+
+# Harmless on a live server (a shell echo); a dry-run server answers "[dry run] ..."
+DRY_RUN_PROBE = "echo aurex replay probe"
+
+# Metrics where a higher value is a regression; throughput is the other way round
+LATENCY_METRICS = ["mean", "p50", "p95", "p99", "max"]
+
+# (offset in seconds from the first command, command text)
+Schedule = List[Tuple[float, str]]
+
+
+class ReplayRefused(Exception):
+    """Raised when a server is not confirmed to be in dry-run mode"""
+
+
+def load_history(path: Path) -> Schedule:
+    """Read a recorded history into a schedule of inter-arrival offsets"""
+    with open(path, 'r') as f:
+        entries = json.load(f)
+
+    schedule = []
+    start = None
+    for entry in entries:
+        timestamp = datetime.fromisoformat(entry["timestamp"])
+        start = start or timestamp
+        schedule.append(((timestamp - start).total_seconds(), entry["command"]))
+    schedule.sort(key=lambda item: item[0])
+    return schedule
+
+
+def synthetic_history(count: int, rate: float, seed: int) -> Schedule:
+    """Poisson arrivals at `rate` commands per second over a fixed command mix"""
+    rng = random.Random(seed)
+    schedule = []
+    offset = 0.0
+    for _ in range(count):
+        schedule.append((offset, rng.choice(SYNTHETIC_COMMANDS)))
+        offset += rng.expovariate(rate)
+    return schedule
+
+
+def scale(schedule: Schedule, speed: float) -> Schedule:
+    """Compress the timing by `speed`; 0 sends everything back to back"""
+    if speed <= 0:
+        return [(0.0, command) for _, command in schedule]
+    return [(offset / speed, command) for offset, command in schedule]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def build_report(commands: int, latencies: List[float], errors: int, duration: float) -> Dict:
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    count = len(latencies_ms)
+    return {
+        "commands": commands,
+        "replies": count,
+        "errors": errors,
+        "duration_s": round(duration, 4),
+        "throughput_per_s": round(count / duration, 2) if duration > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies_ms) / count, 3) if count else 0.0,
+            "p50": round(percentile(latencies_ms, 0.50), 3),
+            "p95": round(percentile(latencies_ms, 0.95), 3),
+            "p99": round(percentile(latencies_ms, 0.99), 3),
+            "max": round(latencies_ms[-1], 3) if count else 0.0
+        }
+    }
+
+
+def replay_executor(schedule: Schedule) -> Dict:
+    """Replay in-process; a command that falls behind schedule runs immediately"""
+    from aurex_server import DryRunExecutor
+
+    executor = DryRunExecutor()
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for offset, command in schedule:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sent = time.perf_counter()
+        result = executor.execute_command(command)
+        latencies.append(time.perf_counter() - sent)
+        if not result.success:
+            errors += 1
+    return build_report(len(schedule), latencies, errors, time.perf_counter() - start)
+
+
+async def replay_websocket(schedule: Schedule, url: str, encoding: str, timeout: float,
+                           allow_live: bool = False) -> Dict:
+    """Replay open-loop over a WebSocket: commands go out on schedule, not on reply
+
+    Unless `allow_live` is set, the server must first answer a probe command
+    as a dry run; recorded histories contain commands like "shutdown".
+    Every command without a successful reply is an error: failed commands,
+    replies that take longer than `timeout` seconds, and anything left
+    unanswered when the connection drops.
+    """
+    import websockets
+
+    codec = codec_for(encoding)
+    latencies = []
+    failures = 0
+    # Replies still owed for commands that already timed out; discarded on arrival
+    overdue = 0
+    # Send times in order; None marks the end of the schedule
+    pending: asyncio.Queue = asyncio.Queue()
+
+    async with websockets.connect(url, subprotocols=[codec.name], max_size=None) as websocket:
+        codec = codec_for(websocket.subprotocol)
+
+        async def next_reply() -> Dict:
+            nonlocal overdue
+            while True:
+                response = codec.decode(await websocket.recv())
+                # Replies to commands; file transfer messages are not ours
+                if "type" in response:
+                    continue
+                # Replies arrive in command order, so a late one belongs to a timed-out command
+                if overdue:
+                    overdue -= 1
+                    continue
+                return response
+
+        if not allow_live:
+            await websocket.send(DRY_RUN_PROBE)
+            try:
+                probe = await asyncio.wait_for(next_reply(), timeout)
+            except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+                raise ReplayRefused(f"{url} did not answer the dry-run probe")
+            if not str(probe.get("output", "")).startswith("[dry run]"):
+                raise ReplayRefused(f"{url} is not in dry-run mode; start it with AUREX_DRY_RUN=1")
+
+        async def drain_overdue():
+            nonlocal overdue
+            while overdue:
+                response = codec.decode(await websocket.recv())
+                if "type" not in response:
+                    overdue -= 1
+
+        async def receive():
+            nonlocal failures, overdue
+            while True:
+                sent = await pending.get()
+                if sent is None:
+                    break
+                try:
+                    response = await asyncio.wait_for(next_reply(), timeout)
+                except asyncio.TimeoutError:
+                    print(f"No reply within {timeout}s")
+                    overdue += 1
+                    continue
+                except websockets.exceptions.ConnectionClosed:
+                    print("Connection closed before all replies arrived")
+                    return
+                latencies.append(time.perf_counter() - sent)
+                if not response.get("success"):
+                    failures += 1
+
+            # Read late replies before closing so none are left in flight
+            try:
+                await asyncio.wait_for(drain_overdue(), timeout)
+            except (asyncio.TimeoutError, websockets.exceptions.ConnectionClosed):
+                pass
+
+        receiver = asyncio.ensure_future(receive())
+        start = time.perf_counter()
+        try:
+            for offset, command in schedule:
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await websocket.send(command)
+                pending.put_nowait(time.perf_counter())
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        pending.put_nowait(None)
+        await receiver
+        duration = time.perf_counter() - start
+
+    errors = failures + len(schedule) - len(latencies)
+    report = build_report(len(schedule), latencies, errors, duration)
+    # The encoding the server actually agreed to, which may not be the one asked for
+    report["encoding"] = codec.name
+    return report
+
+
+async def replay_local_server(schedule: Schedule, encoding: str, timeout: float) -> Dict:
+    """Start a dry-run AurexServer on a free local port and replay against it"""
+    from aurex_server import AurexServer, DryRunExecutor
+
+    server = AurexServer("127.0.0.1", 0, DryRunExecutor())
+    async with server.serve() as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        report = await replay_websocket(schedule, f"ws://127.0.0.1:{port}", encoding, timeout)
+    return report
+
+
+def describe_setup(args, schedule: Schedule) -> Dict:
+    """How this run was produced; baselines only compare against the same setup"""
+    if args.synthetic is not None:
+        source = {"synthetic": args.synthetic, "rate": args.rate, "seed": args.seed}
+    else:
+        source = {"history": str(args.history.resolve())}
+    return {
+        "source": source,
+        "commands": len(schedule),
+        "speed": args.speed,
+        "target": args.url or args.target
+    }
+
+
+def setup_mismatches(report: Dict, baseline: Dict) -> List[str]:
+    """Setup fields that differ between a report and its baseline"""
+    current = report["setup"]
+    saved = baseline.get("setup", {})
+    return [key for key in sorted(set(current) | set(saved)) if current.get(key) != saved.get(key)]
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Print current vs baseline and return the metrics that regressed"""
+    regressions = []
+    print(f"{'metric':<18} {'baseline':>12} {'current':>12} {'change':>9}")
+
+    rows = [(f"latency {name} ms", baseline["latency_ms"][name], report["latency_ms"][name], True)
+            for name in LATENCY_METRICS]
+    rows.append(("throughput /s", baseline["throughput_per_s"], report["throughput_per_s"], False))
+
+    for label, old, new, lower_is_better in rows:
+        change = (new - old) / old if old else 0.0
+        regressed = change > tolerance if lower_is_better else change < -tolerance
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{label:<18} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{flag}")
+        if regressed:
+            regressions.append(label)
+
+    # Any rise in errors is a regression, whatever the tolerance
+    old_errors = baseline.get("errors", 0)
+    new_errors = report["errors"]
+    flag = "  REGRESSION" if new_errors > old_errors else ""
+    print(f"{'errors':<18} {old_errors:>12} {new_errors:>12} {new_errors - old_errors:>+9}{flag}")
+    if new_errors > old_errors:
+        regressions.append("errors")
+    return regressions
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay Aurex command history for performance testing")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--history", type=Path, default=DEFAULT_HISTORY,
+                        help="recorded command history to replay")
+    source.add_argument("--synthetic", type=int, metavar="N",
+                        help="replay N synthetic commands instead of a recorded history")
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="synthetic arrival rate in commands per second")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic history seed")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="replay at N times the recorded pace; 0 for no delays")
+    parser.add_argument("--target", choices=["executor", "server"], default="executor",
+                        help="in-process CommandExecutor or a local dry-run AurexServer")
+    parser.add_argument("--url", help="replay against an already running server (start it with AUREX_DRY_RUN=1)")
+    parser.add_argument("--allow-live", action="store_true",
+                        help="replay even if the server is not in dry-run mode; commands really run")
+    parser.add_argument("--encoding", default="aurex.json",
+                        help="WebSocket subprotocol to request for server replays")
+    parser.add_argument("--timeout", type=float, default=35.0,
+                        help="seconds to wait for each server reply (commands time out after 30)")
+    parser.add_argument("--baseline", type=Path, help="compare against a saved report")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative slowdown before a metric counts as a regression")
+    parser.add_argument("--save-baseline", type=Path, help="write this run's report as the new baseline")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Keep aurex_server's per-command INFO lines out of the report and the measured latency
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.synthetic is not None:
+        schedule = synthetic_history(args.synthetic, args.rate, args.seed)
+    else:
+        try:
+            schedule = load_history(args.history)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Cannot read history {args.history}: {e}")
+            return 1
+    if not schedule:
+        print("Nothing to replay")
+        return 1
+    schedule = scale(schedule, args.speed)
+
+    print(f"Replaying {len(schedule)} commands over {schedule[-1][0]:.2f}s (speed {args.speed})")
+    try:
+        if args.url:
+            report = asyncio.run(replay_websocket(schedule, args.url, args.encoding, args.timeout,
+                                                  args.allow_live))
+        elif args.target == "server":
+            report = asyncio.run(replay_local_server(schedule, args.encoding, args.timeout))
+        else:
+            report = replay_executor(schedule)
+    except ReplayRefused as e:
+        print(f"Refusing to replay: {e} (pass --allow-live to override)")
+        return 2
+
+    setup = describe_setup(args, schedule)
+    if "encoding" in report:
+        setup["encoding"] = report.pop("encoding")
+    report = {"setup": setup, **report}
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved: {args.save_baseline}")
+
+    if args.baseline:
+        try:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read baseline {args.baseline}: {e}")
+            return 1
+        mismatches = setup_mismatches(report, baseline)
+        if mismatches:
+            print(f"Not comparing: baseline was recorded with a different {', '.join(mismatches)}")
+            for key in mismatches:
+                print(f"  {key}: baseline {baseline.get('setup', {}).get(key)!r}, current {setup.get(key)!r}")
+            return 2
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
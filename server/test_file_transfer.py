@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Tests for file_transfer.py
+Run with: python3 -m unittest test_file_transfer
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+import zlib
+from pathlib import Path
+
+from file_transfer import CHUNK_SIZE, FileTransferManager, Transfer, TransferSession
+from protocol import CHUNK_HEADER, JSONCodec
+
+
+class FakeWebSocket:
+    """Collects everything the session sends
+
+    on_start(websocket) runs whenever a file_start goes out, and the first
+    `fail_chunks` chunk sends raise as if the connection had hiccupped.
+    """
+
+    def __init__(self, on_start=None, fail_chunks=0):
+        self.sent = []
+        self.session = None
+        self.on_start = on_start
+        self.fail_chunks = fail_chunks
+
+    async def send(self, message):
+        if not isinstance(message, str) and self.fail_chunks:
+            self.fail_chunks -= 1
+            raise ConnectionError("send failed")
+        self.sent.append(message)
+        if self.on_start and isinstance(message, str) and json.loads(message)["type"] == "file_start":
+            self.on_start(self)
+
+    def messages(self):
+        return [json.loads(message) for message in self.sent if isinstance(message, str)]
+
+    def chunks(self):
+        return [message for message in self.sent if not isinstance(message, str)]
+
+
+class FileTransferTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = Path(self.temp_dir.name)
+        (self.base_dir / "data").mkdir()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_file(self, name: str, size: int) -> Path:
+        path = self.base_dir / "data" / name
+        path.write_bytes(os.urandom(size))
+        return path
+
+
+class TransferTests(FileTransferTestCase):
+
+    def test_read_chunk_of_shrunken_file(self):
+        path = self.write_file("shrinking.bin", CHUNK_SIZE * 2)
+        with open(path, 'rb', buffering=0) as file:
+            transfer = Transfer(1, path, file, CHUNK_SIZE * 2, 0)
+            os.truncate(path, CHUNK_SIZE + 100)
+
+            first = transfer.read_chunk()
+            second = transfer.read_chunk()
+
+            self.assertEqual(len(first), CHUNK_HEADER.size + CHUNK_SIZE)
+            self.assertEqual(len(second), CHUNK_HEADER.size + 100)
+            transfer_id, offset, crc32 = CHUNK_HEADER.unpack_from(second)
+            self.assertEqual((transfer_id, offset), (1, CHUNK_SIZE))
+            self.assertEqual(crc32, zlib.crc32(second[CHUNK_HEADER.size:]))
+            self.assertIsNone(transfer.read_chunk())
+            self.assertEqual(transfer.offset, CHUNK_SIZE + 100)
+
+
+class TransferSessionTests(FileTransferTestCase):
+
+    def run_session(self, requests, **fake_options):
+        websocket = FakeWebSocket(**fake_options)
+
+        async def scenario():
+            session = TransferSession(FileTransferManager(self.base_dir), websocket, JSONCodec())
+            websocket.session = session
+            for request in requests:
+                await session.handle_request(request)
+                # Let hashing and streaming run before the next request
+                await asyncio.sleep(0.1)
+            await session.close()
+
+        asyncio.run(scenario())
+        return websocket
+
+    def test_streams_whole_file(self):
+        path = self.write_file("whole.bin", CHUNK_SIZE + 10)
+        websocket = self.run_session([{"type": "file_get", "path": "data/whole.bin"}])
+
+        types = [message["type"] for message in websocket.messages()]
+        self.assertEqual(types, ["file_start", "file_end"])
+        data = b"".join(bytes(chunk[CHUNK_HEADER.size:]) for chunk in websocket.chunks())
+        self.assertEqual(data, path.read_bytes())
+
+    def test_shrunken_file_reports_error(self):
+        path = self.write_file("shrinking.bin", CHUNK_SIZE * 3)
+        websocket = self.run_session(
+            [{"type": "file_get", "path": "data/shrinking.bin"}],
+            on_start=lambda websocket: os.truncate(path, CHUNK_SIZE + 100)
+        )
+
+        messages = websocket.messages()
+        self.assertEqual(messages[0]["type"], "file_start")
+        self.assertEqual(messages[-1]["type"], "file_error")
+        self.assertIn("File changed during transfer", messages[-1]["error"])
+
+    def test_read_error_only_ends_that_transfer(self):
+        self.write_file("broken.bin", CHUNK_SIZE * 2)
+        path = self.write_file("fine.bin", CHUNK_SIZE * 2)
+
+        def break_first_transfer(websocket):
+            transfer = websocket.session.transfers.get(1)
+            if transfer is not None:
+                transfer.file.close()
+
+        websocket = self.run_session([
+            {"type": "file_get", "path": "data/broken.bin"},
+            {"type": "file_get", "path": "data/fine.bin"}
+        ], on_start=break_first_transfer)
+
+        results = {message["transfer_id"]: message["type"] for message in websocket.messages()
+                   if message["type"] != "file_start"}
+        self.assertEqual(results, {1: "file_error", 2: "file_end"})
+        data = b"".join(bytes(chunk[CHUNK_HEADER.size:]) for chunk in websocket.chunks())
+        self.assertEqual(data, path.read_bytes())
+
+    def test_scheduler_restarts_after_send_failure(self):
+        self.write_file("first.bin", CHUNK_SIZE)
+        path = self.write_file("second.bin", CHUNK_SIZE)
+        websocket = self.run_session([
+            {"type": "file_get", "path": "data/first.bin"},
+            {"type": "file_get", "path": "data/second.bin"}
+        ], fail_chunks=1)
+
+        self.assertEqual(websocket.messages()[-1], {
+            "type": "file_end", "transfer_id": 2, "size": CHUNK_SIZE, "success": True
+        })
+        self.assertEqual(bytes(websocket.chunks()[-1][CHUNK_HEADER.size:]), path.read_bytes())
+
+    def test_file_get_does_not_wait_for_hashing(self):
+        self.write_file("large.bin", CHUNK_SIZE * 4)
+        websocket = FakeWebSocket()
+
+        async def scenario():
+            session = TransferSession(FileTransferManager(self.base_dir), websocket, JSONCodec())
+            await session.handle_request({"type": "file_get", "path": "data/large.bin"})
+            # The request returns before the file is hashed and file_start is sent
+            self.assertEqual(websocket.sent, [])
+            await asyncio.sleep(0.1)
+            await session.close()
+
+        asyncio.run(scenario())
+        self.assertEqual([message["type"] for message in websocket.messages()], ["file_start", "file_end"])
+
+    def test_rejects_paths_outside_roots(self):
+        websocket = self.run_session([{"type": "file_get", "path": "../secret"}])
+
+        self.assertEqual(websocket.messages()[0]["type"], "file_error")
+
+
+if __name__ == "__main__":
+    unittest.main()